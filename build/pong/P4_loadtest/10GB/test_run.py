@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os,sys,socket,time
-from P4 import P4,P4Exception    # Import the module
+from P4 import P4,P4Exception,OutputHandler    # Import the module
 # Create the P4 instance
 p4 = P4()
 
@@ -65,15 +66,40 @@ def get_server_time():
 def get_throughput(size, time):
     return size / time
 
+##
+class SyncProgressHandler(OutputHandler):
+    # Consumes per-file sync stats as they stream in, so the 10k-file and
+    # 20GB syncs do not accumulate a giant result list, and prints a
+    # progress line every report_every files. Messages (errors/warnings)
+    # keep their normal handling.
+    def __init__(self, report_every=1000):
+        OutputHandler.__init__(self)
+        self.files = 0
+        self.report_every = report_every
+
+    def outputStat(self, stat):
+        self.files += 1
+        if self.files % self.report_every == 0:
+            print "  ... {0} files synced".format(self.files)
+        return OutputHandler.HANDLED
+
+##
+def streamed_sync(*args):
+    p4.handler = SyncProgressHandler()
+    try:
+        p4.run_sync(*args)
+    finally:
+        p4.handler = None
+
 ##
 def sync_latest(parallel=0):
     try:
         # Sync wrapped in try as being up to date is a "warning" <smh>
-        if parallel > 0:            
-            p4.run_sync("--parallel=threads={0}".format(parallel))
+        if parallel > 0:
+            streamed_sync("--parallel=threads={0}".format(parallel))
         else:
-            p4.run_sync()
-    except P4Exception:        
+            streamed_sync()
+    except P4Exception:
         print "Sync output:"
         for e in p4.errors:
             print "  " + e
@@ -95,8 +121,7 @@ def create_new_cl(desc = "empty description"):
 
 ##        
 def submit_cl(cl, desc, parallel=0, batch=100, min=10):
-    print "===================="
-    print "Submitting CL " + cl + "..." + desc
+    print "====================\nSubmitting CL " + cl + "..." + desc
     start = time.time()
     if parallel > 0:
         ret = p4.run_submit('-c',cl,"--parallel=threads={0},batch={1},min={2}".format(parallel,batch,min))
@@ -104,19 +129,13 @@ def submit_cl(cl, desc, parallel=0, batch=100, min=10):
         ret = p4.run_submit('-c',cl)
     end = time.time()
     elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="
+    print "====================\nTime elapsed (s): {0:0.2f}\n====================".format(elapsed)
     return elapsed
     
 ##
 def test_1a():
 
-    print "===================="
-    print "test_1a"    
-    print "1 * 20GB file"
-    print "commit, serial"
-    print "===================="
+    print "====================\ntest_1a\n1 * 20GB file\ncommit, serial\n===================="
 
     sync_latest()
     print "===================="
@@ -129,38 +148,26 @@ def test_1a():
     ret = p4.run_add('-c',cl,os_big_file)
     print ret
     elapsed = submit_cl(cl, desc)    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_big_file_size_mb, elapsed))
-    print "===================="
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_big_file_size_mb, elapsed))
 
 ##      
 def test_1b():
 
-    print "===================="
-    print "test_1b"    
-    print "1 * 20GB file"
-    print "sync, serial"
-    print "===================="
+    print "====================\ntest_1b\n1 * 20GB file\nsync, serial\n===================="
     print "Syncing to " + p4_big_file
     start = time.time()
-    p4.run_sync("-f",p4_big_file)
+    streamed_sync("-f",p4_big_file)
     end = time.time() 
     elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_big_file_size_mb, elapsed))
-    print "===================="
+    print "====================\nTime elapsed (s): {0:0.2f}\n====================".format(elapsed)
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_big_file_size_mb, elapsed))
     
     delete_large_file()
 
 ##
 def test_1c():
 
-    print "===================="
-    print "test_1c"   
-    print "1 * 20GB file"
-    print "commit, --parallel=threads=100,batch=1,min=1"
-    print "===================="
+    print "====================\ntest_1c\n1 * 20GB file\ncommit, --parallel=threads=100,batch=1,min=1\n===================="
 
     sync_latest()
     print "===================="
@@ -174,39 +181,27 @@ def test_1c():
     print ret
     elapsed = submit_cl(cl, desc, 100, 1, 1)
     #elapsed = submit_cl(cl, desc, 0, 1, 1)
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_big_file_size_mb, elapsed))
-    print "===================="
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_big_file_size_mb, elapsed))
     
     
 ##
 def test_1d():
 
-    print "===================="
-    print "test_1d"    
-    print "1 * 20GB file"
-    print "sync, --parallel=threads=100,batch=1,min=1"
-    print "===================="
+    print "====================\ntest_1d\n1 * 20GB file\nsync, --parallel=threads=100,batch=1,min=1\n===================="
     print "Syncing to " + p4_big_file
     start = time.time()
-    p4.run_sync("--parallel=threads=100,batch=1,min=1","-f",p4_big_file)
+    streamed_sync("--parallel=threads=100,batch=1,min=1","-f",p4_big_file)
     end = time.time()    
     elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_big_file_size_mb, elapsed))
-    print "===================="
+    print "====================\nTime elapsed (s): {0:0.2f}\n====================".format(elapsed)
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_big_file_size_mb, elapsed))
         
     delete_large_file()
   
 ##  
 def test_2a():
 
-    print "===================="
-    print "test_2a"    
-    print "10000 * 16KB files"
-    print "commit, serial"
-    print "===================="
+    print "====================\ntest_2a\n10000 * 16KB files\ncommit, serial\n===================="
 
     sync_latest()
     print "===================="
@@ -219,38 +214,38 @@ def test_2a():
     print "Adding " + p4_10k_files_dir
     ret = p4.run_add('-c',cl,p4_10k_files_dir)
     elapsed = submit_cl(cl, desc)
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_10k_files_size_mb, elapsed))
 
 ##
-def test_2b():
-
-    print "===================="
-    print "test_2b"    
-    print "10000 * 16KB files"
-    print "sync, serial"    
-    print "===================="
+def run_sync_test(name, parallel=0, batch=100, min=10):
+    if parallel > 0:
+        mode = "sync, --parallel=threads={0},batch={1},min={2}".format(parallel,batch,min)
+    else:
+        mode = "sync, serial"
+    print "====================\n" + name + "\n10000 * 16KB files\n" + mode + "\n===================="
     print "Syncing to " + p4_10k_files_dir
     start = time.time()
-    p4.run_sync("-f",p4_10k_files_dir)
-    end = time.time()    
+    if parallel > 0:
+        streamed_sync("--parallel=threads={0},batch={1},min={2}".format(parallel,batch,min),"-f",p4_10k_files_dir)
+    else:
+        streamed_sync("-f",p4_10k_files_dir)
+    end = time.time()
     elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "====================" 
-    
+    print "====================\nTime elapsed (s): {0:0.2f}\n====================".format(elapsed)
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_10k_files_size_mb, elapsed))
+    return elapsed
+
+##
+def test_2b():
+
+    run_sync_test("test_2b")
+
     delete_10k_files()
 
 ##
 def test_2c():
 
-    print "===================="
-    print "test_2c"    
-    print "10000 * 16KB files"
-    print "commit, --parallel=threads=100,batch=100,min=10"
-    print "===================="
+    print "====================\ntest_2c\n10000 * 16KB files\ncommit, --parallel=threads=100,batch=100,min=10\n===================="
 
     sync_latest()
     print "===================="
@@ -264,142 +259,107 @@ def test_2c():
     ret = p4.run_add('-c',cl,p4_10k_files_dir)
     elapsed = submit_cl(cl, desc, 100, 100, 10)
     #elapsed = submit_cl(cl, desc, 0, 100, 10)
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
+    print "Throughput (mb/s) : {0:0.2f}\n====================".format(get_throughput(os_10k_files_size_mb, elapsed))
    
-##   
+##
 def test_2d():
 
-    print "===================="
-    print "test_2d"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=100,batch=100,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=100,batch=100,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
-  
-##  
+    run_sync_test("test_2d", 100, 100, 10)
+
+##
 def test_2e():
 
-    print "===================="
-    print "test_2e"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=50,batch=100,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=50,batch=100,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
-  
-##  
+    run_sync_test("test_2e", 50, 100, 10)
+
+##
 def test_2f():
 
-    print "===================="
-    print "test_2f"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=25,batch=100,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=25,batch=100,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
+    run_sync_test("test_2f", 25, 100, 10)
 
-##    
+##
 def test_2g():
 
-    print "===================="
-    print "test_2g"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=10,batch=100,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=10,batch=100,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
- 
-## 
+    run_sync_test("test_2g", 10, 100, 10)
+
+##
 def test_2h():
 
-    print "===================="
-    print "test_2h"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=5,batch=100,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=5,batch=100,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
-    
-## 
+    run_sync_test("test_2h", 5, 100, 10)
+
+##
 def test_2i():
 
-    print "===================="
-    print "test_2i"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=50,batch=200,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=50,batch=200,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
+    run_sync_test("test_2i", 50, 200, 10)
 
-## 
+##
 def test_2j():
 
-    print "===================="
-    print "test_2j"    
-    print "10000 * 16KB files"
-    print "sync, --parallel=threads=20,batch=500,min=10"
-    print "===================="
-    print "Syncing to " + p4_10k_files_dir
-    start = time.time()
-    p4.run_sync("--parallel=threads=20,batch=500,min=10","-f",p4_10k_files_dir)
-    end = time.time()    
-    elapsed = end - start
-    print "===================="
-    print "Time elapsed (s): {0:0.2f}".format(elapsed)
-    print "===================="    
-    print "Throughput (mb/s) : {0:0.2f}".format(get_throughput(os_10k_files_size_mb, elapsed))
-    print "===================="
-            
+    run_sync_test("test_2j", 20, 500, 10)
+
+    delete_10k_files()
+
+##
+def tune_parallel(size_mb, start=5, cap=200):
+
+    # There is no one-size-fits-all thread count - the knee depends on
+    # the host, network and server. Probe a few counts once, refine
+    # around the winner, and cache the result per host/server/dir.
+    cache_path = os.path.expanduser("~/.p4perftune.json")
+    cache_key = "{0}|{1}|{2}".format(socket.gethostname(), p4.port, p4_10k_files_dir)
+    cache = {}
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+    if cache_key in cache:
+        print "Using cached parallel thread count: {0}".format(cache[cache_key])
+        return cache[cache_key]
+
+    results = {}
+    for threads in (start, start * 4, cap):
+        elapsed = run_sync_test("tune_parallel threads={0}".format(threads), threads)
+        results[threads] = get_throughput(size_mb, elapsed)
+    best = max(results, key=results.get)
+
+    # One refinement probe between the winner and its nearest rival.
+    rival = sorted((t for t in results if t != best), key=lambda t: abs(t - best))[0]
+    probe = (best + rival) / 2
+    if probe not in results:
+        elapsed = run_sync_test("tune_parallel threads={0}".format(probe), probe)
+        results[probe] = get_throughput(size_mb, elapsed)
+        best = max(results, key=results.get)
+
+    cache[cache_key] = best
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+    print "Tuned parallel thread count: {0}".format(best)
+    return best
+
+##
+def test_2_tuned():
+
+    threads = tune_parallel(os_10k_files_size_mb)
+    run_sync_test("test_2_tuned", threads)
+
+    delete_10k_files()
+
+##
+def test_2_sync_sweep():
+
+    # Whole sync matrix over the one connection made at startup, instead
+    # of paying interpreter + connect + login per configuration from a
+    # shell loop.
+    run_sync_test("test_2b")
+    run_sync_test("test_2d", 100, 100, 10)
+    run_sync_test("test_2e", 50, 100, 10)
+    run_sync_test("test_2f", 25, 100, 10)
+    run_sync_test("test_2g", 10, 100, 10)
+    run_sync_test("test_2h", 5, 100, 10)
+    run_sync_test("test_2i", 50, 200, 10)
+    run_sync_test("test_2j", 20, 500, 10)
+
     delete_10k_files()
 
 #------------------------------
@@ -408,23 +368,13 @@ def test_2j():
 try:
     testfunc = globals()[sys.argv[1]]
 except:
-    print "Test has to be one of:"
-    print "test_1a"
-    print "test_1b"
-    print "test_1c"
-    print "test_1d"
-    print "test_2a"
-    print "test_2b"
-    print "test_2c"
-    print "test_2d"
-    print "test_2e"
-    print "test_2f"
-    print "test_2g"
-    print "test_2h"
-    print "test_2i"
-    print "test_2j"
-    print "delete_large_file"
-    print "delete_10k_files"
+    print "\n".join(["Test has to be one of:",
+                     "test_1a", "test_1b", "test_1c", "test_1d",
+                     "test_2a", "test_2b", "test_2c", "test_2d",
+                     "test_2e", "test_2f", "test_2g", "test_2h",
+                     "test_2i", "test_2j",
+                     "test_2_tuned", "test_2_sync_sweep",
+                     "delete_large_file", "delete_10k_files"])
     quit()
     
 # Main
@@ -435,24 +385,39 @@ try:
     ret = p4.run_login()
     #print ret
 
-    # Switch client root relative to cwd
-    client = p4.fetch_client( "-t", template_client )
-    client._root = client_root    
-    client._host = socket.gethostname()
-    client._client = client._client + "_" + client._host
-    #print client
-    p4.save_client( client )
-    p4.client = client._client           
+    # Switch client root relative to cwd; the per-host client is cached so
+    # repeat runs skip the fetch_client/save_client round-trips.
+    hostname = socket.gethostname()
+    client_cache = {}
+    if os.path.isfile("client_cache.json"):
+        try:
+            with open("client_cache.json") as f:
+                client_cache = json.load(f)
+        except ValueError:
+            client_cache = {}
+    cached_client = client_cache.get(hostname)
+    if cached_client and p4.run("clients", "-e", cached_client):
+        p4.client = cached_client
+    else:
+        client = p4.fetch_client( "-t", template_client )
+        client._root = client_root
+        client._host = hostname
+        client._client = client._client + "_" + hostname
+        #print client
+        p4.save_client( client )
+        p4.client = client._client
+        client_cache[hostname] = client._client
+        with open("client_cache.json", "w") as f:
+            json.dump(client_cache, f)
 
     # Run "p4 info" (returns a dict)
     #info = p4.run( "info" )        
     #for key in info[0]:            # and display all key-value pairs
     #    print key, "=", info[0][key]
     
-    print "************************************************************"
-    print "===================="
-    print "server time = " + get_server_time()    
-    
+    print "************************************************************\n====================\nserver time = " + get_server_time()
+
+
     testfunc()
         
     # Disconnect from the server
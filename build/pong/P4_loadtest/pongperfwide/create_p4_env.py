@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os,sys,socket,time
+from multiprocessing.dummy import Pool as ThreadPool
 from P4 import P4,P4Exception    # Import the module
 # Create the P4 instance
 p4 = P4()
@@ -25,21 +26,45 @@ p4.password = ""
 
 BaseUserName = "pongperfwide"
 NumberOfUsers = 180
+NumberOfConnections = 8
 
 ##
-def create_users(basename, numberUsers): 
-    
-    # add new user to p4
-    for i in range(numberUsers):
+def _create_user_range(args):
+    p4conn, basename, indices = args
+    for i in indices:
         newuser = {
             'User': '{0}-{1}'.format(basename, i),
             'Email': '{0}-{1}@domain.com'.format(basename, i),
             'FullName': 'PongPerfWide User {0}'.format(i),
             # 'Password': '{0}-{1}'.format(basename, i) # passwords have to be set by user or by super manually!
         }
-        ret = p4.save_user(newuser,"-f")
-        print ret        
-            
+        ret = p4conn.save_user(newuser,"-f")
+        print ret
+
+##
+def create_users(basename, numberUsers):
+
+    # add new users over a pool of connections so several save_user RPCs
+    # are in flight at once; each worker thread owns one connection
+    connections = []
+    for _ in range(NumberOfConnections):
+        conn = P4()
+        conn.port = p4.port
+        conn.user = p4.user
+        conn.password = p4.password
+        conn.connect()
+        conn.run_login()
+        connections.append(conn)
+
+    chunks = [range(c, numberUsers, NumberOfConnections) for c in range(NumberOfConnections)]
+    pool = ThreadPool(NumberOfConnections)
+    pool.map(_create_user_range, [(conn, basename, chunk) for conn, chunk in zip(connections, chunks)])
+    pool.close()
+    pool.join()
+
+    for conn in connections:
+        conn.disconnect()
+
     # print to use in adding to groups
     for i in range(numberUsers):
         print '{0}-{1}'.format(basename, i)
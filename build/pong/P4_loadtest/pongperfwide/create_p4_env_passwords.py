@@ -12,20 +12,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
+import os,sys
+from P4 import P4,P4Exception    # Import the module
+# Create the P4 instance
+p4 = P4()
+
+# Set some environment variables
+p4.port = "ssl:localhost:1666"
+p4.user = "super"
+p4.password = ""
 
 BaseUserName = "pongperfwide"
 NumberOfUsers = 180
 
 ##
-def create_user_pwds(basename, numberUsers): 
-    
-    # add new user to p4
-    for i in range(numberUsers):        
-        p = os.popen("p4 passwd {0}-{1}".format(basename, i), "w")
-        p.write("{0}-{1}\n".format(basename, i))     
-        p.write("{0}-{1}\n".format(basename, i))
-    
+def create_user_pwds(basename, numberUsers):
+
+    # set each user's password over the single connected session
+    for i in range(numberUsers):
+        user = '{0}-{1}'.format(basename, i)
+        ret = p4.run('passwd', '-P', user, user)
+        print ret
+
 #------------------------------
-    
-create_user_pwds(BaseUserName, NumberOfUsers)
\ No newline at end of file
+
+# Main
+try:
+    # Connect + login
+    ret = p4.connect()
+    print ret
+    ret = p4.run_login()
+    #print ret
+
+    create_user_pwds(BaseUserName, NumberOfUsers)
+
+    # Disconnect from the server
+    p4.disconnect()
+    print "************************************************************"
+except P4Exception as ex:
+    print ('Error: %s' % ex)
+    for e in p4.errors:
+        print e
+    for e in p4.warnings:
+        print e
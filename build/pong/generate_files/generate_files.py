@@ -20,9 +20,26 @@ import os
 PLANETS = ['ordmantell', 'abafar', 'aeosprime', 'agamar', 'ahchto', 'ajankloss', 'akiva', 'alderaan', 'alzociii', 'ando', 'anoat', 'arvala', 'atollon', 'batuu', 'behpour', 'bespin', 'bogano', 'bracca', 'cantonica', 'castilon', 'catoneimoidia', 'celsor', 'chandrila', 'christophsis', 'concorddawn', 'corellia', 'coruscant', 'crait', 'dqar', 'dagobah', 'dandoran', 'dantooine', 'dathomir', 'devaron', 'eadu', 'endor', 'eriadu', 'exegol', 'felucia', 'florrum', 'fondor', 'geonosis', 'hosnianprime', 'hoth', 'iego', 'ilum', 'iridonia', 'jakku', 'jedha',
            'kamino', 'kashyyyk', 'kefbir', 'kessel', 'kijimi', 'kuat', 'lahmu', 'lirasan', 'lothal', 'lothominor', 'malachor', 'malastare', 'mandalore', 'maridun', 'mimban', 'moncala', 'moraband', 'mortis', 'mustafar', 'mygeeto', 'naboo', 'nalhutta', 'nevarro', 'nur', 'onderon', 'pasaana', 'pillio', 'polismassa', 'rishi', 'rodia', 'ruusan', 'ryloth', 'saleucami', 'savareen', 'scarif', 'serenno', 'shili', 'sorgan', 'starkillerbase', 'subterrel', 'sullust', 'takodana', 'tatooine', 'toydaria', 'trandosha', 'umbara', 'utapau', 'vandor', 'vardos', 'wobani', 'yavin', 'zeffo', 'zygerria']
 
+FILE_SIZE = 16384
+NUM_SHARDS = 16
+
 planet_index = 0
 planet_systems = defaultdict(int)
 
+# Pre-drawn random bodies, rotated per file and stamped in place; a unique
+# 4-byte header keeps every file distinct without drawing 16 KiB of fresh
+# entropy each time.
+random_buffers = [bytearray(os.urandom(FILE_SIZE)) for _ in range(NUM_SHARDS)]
+
+# Spread the files over shard subdirectories to break up per-directory
+# write locks; the pooled dir fds let os.open skip the full path walk.
+shard_fds = []
+for shard in range(NUM_SHARDS):
+  shard_name = 'shard_%02x' % shard
+  if not os.path.isdir(shard_name):
+    os.mkdir(shard_name)
+  shard_fds.append(os.open(shard_name, os.O_RDONLY))
+
 for i in range(10000):
   planet = PLANETS[planet_index]
   planet_index += 1
@@ -30,8 +47,18 @@ for i in range(10000):
     planet_index = 0
 
   planet_systems[planet] += 1
-  
+
+  shard = i & (NUM_SHARDS - 1)
   filename = '%s-%d.dat' % (planet, planet_systems[planet])
-  print(filename)
-  os.system('head -c 16384 </dev/urandom > %s' % filename)
-  
\ No newline at end of file
+  print('shard_%02x/%s' % (shard, filename))
+  buf = random_buffers[shard]
+  buf[0:4] = i.to_bytes(4, 'little')
+  fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644,
+               dir_fd=shard_fds[shard])
+  try:
+    os.pwrite(fd, buf, 0)
+  finally:
+    os.close(fd)
+
+for fd in shard_fds:
+  os.close(fd)
